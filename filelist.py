@@ -0,0 +1,324 @@
+u"""Finding input files."""
+
+import collections
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import kutil
+from io import open
+from multiprocessing.pool import ThreadPool
+
+
+THREADS = 8
+
+HASH_BLOCK = 1 << 20
+
+
+def pathkey(x):
+    return os.path.normcase(os.path.abspath(x))
+
+
+def _plan(pattern):
+    # Split into a literal directory and the remaining components,
+    # in the same way as glob.glob recurses.
+    parts = []
+    while glob.has_magic(pattern):
+        dirname, basename = os.path.split(pattern)
+        parts.append(basename)
+        pattern = dirname
+        if dirname == u'':
+            break
+    return pattern, parts[::-1]
+
+
+def _literal(path):
+    dirname, basename = os.path.split(path)
+    if basename == u'':
+        return os.path.isdir(dirname)
+    else:
+        return os.path.lexists(path)
+
+
+def _getsize(path):
+    try:
+        return os.path.getsize(path)
+    except os.error:
+        return 0
+
+
+def _identity(path):
+    try:
+        st = os.stat(path)
+    except os.error:
+        return None
+    if st.st_ino == 0:
+        # Not available on this platform.
+        return None
+    return st.st_dev, st.st_ino
+
+
+def _hash(path):
+    h = hashlib.sha1()
+    try:
+        with open(path, u'rb') as f:
+            while True:
+                data = f.read(HASH_BLOCK)
+                if len(data) == 0:
+                    break
+                h.update(data)
+    except IOError:
+        return None
+    return h.hexdigest()
+
+
+def _filter(names, pattern):
+    if pattern[0] != u'.':
+        names = [x for x in names if x[0] != u'.']
+    return fnmatch.filter(names, pattern)
+
+
+class FileList(object):
+    def __init__(self, cachefile=None):
+        self.cachefile = cachefile
+        self.cache = None
+        self.globs = {}
+        if cachefile is not None:
+            self.cache = {}
+            try:
+                with open(cachefile) as f:
+                    self.cache = json.load(f)
+            except (IOError, ValueError):
+                pass
+
+    def expand(self, patterns):
+        todo = []
+        for pattern in patterns:
+            if pattern in self.globs:
+                continue
+            base, parts = _plan(pattern)
+            self.globs[pattern] = [base]
+            todo.append((pattern, parts))
+        if len(todo) == 0:
+            return
+        pool = ThreadPool(THREADS)
+        try:
+            self._expand(pool, todo)
+        finally:
+            pool.close()
+
+    def _expand(self, pool, todo):
+        level = 0
+        while len(todo) > 0:
+            listdir = set()
+            literal = set()
+            for pattern, parts in todo:
+                if len(parts) == 0:
+                    literal.update(self.globs[pattern])
+                elif glob.has_magic(parts[level]):
+                    listdir.update(self.globs[pattern])
+                else:
+                    literal.update(os.path.join(d, parts[level]) for d in self.globs[pattern])
+            listdir = sorted(listdir)
+            literal = sorted(literal)
+            names = dict(zip(listdir, pool.map(self._listdir, listdir)))
+            exists = dict(zip(literal, pool.map(_literal, literal)))
+            nexttodo = []
+            for pattern, parts in todo:
+                if len(parts) == 0:
+                    l = [x for x in self.globs[pattern] if exists[x]]
+                elif glob.has_magic(parts[level]):
+                    l = []
+                    for d in self.globs[pattern]:
+                        for x in _filter(names[d], parts[level]):
+                            l.append(os.path.join(d, x))
+                else:
+                    l = []
+                    for d in self.globs[pattern]:
+                        x = os.path.join(d, parts[level])
+                        if exists[x]:
+                            l.append(x)
+                self.globs[pattern] = l
+                if len(parts) > level + 1:
+                    nexttodo.append((pattern, parts))
+            todo = nexttodo
+            level += 1
+
+    def _listdir(self, d):
+        path = d if d != u'' else unicode(os.curdir)
+        if self.cache is None:
+            try:
+                return os.listdir(path)
+            except os.error:
+                return []
+        key = pathkey(path)
+        try:
+            mtime = os.stat(path).st_mtime
+        except os.error:
+            return []
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            names = os.listdir(path)
+        except os.error:
+            return []
+        self.cache[key] = [mtime, names]
+        return names
+
+    def save(self):
+        if self.cachefile is None:
+            return
+        try:
+            with open(self.cachefile, u'w') as f:
+                f.write(unicode(json.dumps(self.cache)))
+        except:
+            kutil.exception_exit(u'error writing file list cache: {}'.format(self.cachefile))
+
+    def sizes(self, paths):
+        pool = ThreadPool(THREADS)
+        try:
+            return pool.map(_getsize, paths)
+        finally:
+            pool.close()
+
+    def duplicates(self, paths, sizes):
+        """For each path, return None or (i, reason) if paths[i] is an
+        earlier copy of it.
+
+        The reason is u"path" for the same path, u"file" for a link to
+        the same file, and u"contents" for a file with the same contents.
+        Only files of equal size are read and compared.
+        """
+        result = [None] * len(paths)
+        first = {}
+        for i, x in enumerate(paths):
+            key = pathkey(x)
+            if key in first:
+                result[i] = (first[key], u"path")
+            else:
+                first[key] = i
+        todo = [i for i in xrange(len(paths)) if result[i] is None]
+        pool = ThreadPool(THREADS)
+        try:
+            first = {}
+            ids = pool.map(_identity, [paths[i] for i in todo])
+            for i, key in zip(todo, ids):
+                if key is None:
+                    continue
+                if key in first:
+                    result[i] = (first[key], u"file")
+                else:
+                    first[key] = i
+            bysize = collections.defaultdict(list)
+            for i in todo:
+                if result[i] is None:
+                    bysize[sizes[i]].append(i)
+            todo = sorted(i for l in bysize.values() if len(l) > 1 for i in l)
+            first = {}
+            hashes = pool.map(_hash, [paths[i] for i in todo])
+            for i, h in zip(todo, hashes):
+                if h is None:
+                    continue
+                key = (sizes[i], h)
+                if key in first:
+                    result[i] = (first[key], u"contents")
+                else:
+                    first[key] = i
+        finally:
+            pool.close()
+        return result
+
+    def get(self, patterns):
+        self.expand(patterns)
+        l = []
+        for x in patterns:
+            g = self.globs[x]
+            if len(g) == 0:
+                sys.exit(u'pattern does not match any file: {}'.format(x))
+            l += g
+        return l
+
+
+#### Unit tests
+
+
+class TestFileList(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.orig = os.getcwdu()
+        os.chdir(self.dir)
+        for d in [u'a', u'a/x', u'a/y', u'b', u'b/x', u'.h']:
+            os.mkdir(d)
+        for f in [u'a/1.txt', u'a/2.txt', u'a/x/3.txt', u'a/y/4.dat',
+                  u'b/x/5.txt', u'b/.6.txt', u'.h/7.txt', u'8.txt']:
+            with open(f, u'w') as fp:
+                fp.write(u'')
+
+    def tearDown(self):
+        os.chdir(self.orig)
+        shutil.rmtree(self.dir)
+
+    def test_glob(self):
+        patterns = [
+            u'*', u'*.txt', u'*/*.txt', u'*/*/*.txt', u'a/*', u'a/*/',
+            u'a/x/3.txt', u'a/x/9.txt', u'*/x/3.txt', u'[ab]/*/*',
+            u'b/.*', u'.*/*', u'a//*', u'a/', u'c/*', u'a/1.txt/*',
+            self.dir + u'/*/*.txt',
+        ]
+        fl = FileList()
+        fl.expand(patterns)
+        for x in patterns:
+            self.assertEqual(fl.globs[x], glob.glob(x), x)
+
+    def test_get(self):
+        fl = FileList()
+        self.assertEqual(sorted(fl.get([u'a/*.txt', u'8.txt'])), [u'8.txt', u'a/1.txt', u'a/2.txt'])
+
+    def test_cache(self):
+        cachefile = os.path.join(self.dir, u'cache.json')
+        fl = FileList(cachefile)
+        self.assertEqual(fl.get([u'a/*.txt']), glob.glob(u'a/*.txt'))
+        fl.save()
+        fl = FileList(cachefile)
+        self.assertIn(pathkey(u'a'), fl.cache)
+        fl.cache[pathkey(u'a')][1].append(u'cached.txt')
+        self.assertIn(u'a/cached.txt', fl.get([u'a/*.txt']))
+        fl.save()
+        fl = FileList(cachefile)
+        os.utime(u'a', (0, 0))
+        self.assertEqual(fl.get([u'a/*.txt']), glob.glob(u'a/*.txt'))
+
+    def test_sizes(self):
+        with open(u'a/1.txt', u'w') as f:
+            f.write(u'abc')
+        self.assertEqual(FileList().sizes([u'a/1.txt', u'a/2.txt', u'a/9.txt']), [3, 0, 0])
+
+    def test_duplicates(self):
+        with open(u'a/1.txt', u'w') as f:
+            f.write(u'abc')
+        with open(u'a/2.txt', u'w') as f:
+            f.write(u'abd')
+        with open(u'b/x/5.txt', u'w') as f:
+            f.write(u'abc')
+        os.symlink(os.path.join(self.dir, u'a/2.txt'), u'b/link.txt')
+        paths = [u'a/1.txt', u'a/2.txt', u'b/x/5.txt', u'a//1.txt',
+                 u'b/link.txt', u'8.txt', u'a/x/3.txt', u'a/9.txt']
+        fl = FileList()
+        self.assertEqual(fl.duplicates(paths, fl.sizes(paths)), [
+            None, None, (0, u"contents"), (0, u"path"),
+            (1, u"file"), None, (5, u"contents"), None,
+        ])
+
+    def test_pathkey(self):
+        self.assertEqual(pathkey(u'a/x/../1.txt'), pathkey(u'a//1.txt'))
+        self.assertEqual(pathkey(u'a/1.txt'), pathkey(os.path.join(self.dir, u'a/1.txt')))
+
+
+if __name__ == u'__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+u"""Collocates of searches, counted in bounded memory."""
+
+import array
+import math
+import random
+import unittest
+
+
+# Size of each count-min sketch. With probability 1 - exp(-DEPTH), an
+# estimate exceeds the true count by at most e / WIDTH of all counts.
+WIDTH = 4096
+DEPTH = 4
+PRIME = (1 << 61) - 1
+
+
+class CountMinSketch(object):
+    """Approximate counts of integers; never less than the true count."""
+
+    def __init__(self, width=WIDTH, depth=DEPTH, seed=0):
+        rnd = random.Random(seed)
+        self.width = width
+        self.hashes = [(rnd.randrange(1, PRIME), rnd.randrange(PRIME)) for i in xrange(depth)]
+        self.rows = [array.array('l', [0]) * width for i in xrange(depth)]
+
+    def add(self, x):
+        """Count x once and return its estimated count."""
+        est = None
+        for (a, b), row in zip(self.hashes, self.rows):
+            j = (a * x + b) % PRIME % self.width
+            row[j] += 1
+            if est is None or row[j] < est:
+                est = row[j]
+        return est
+
+    def estimate(self, x):
+        return min(row[(a * x + b) % PRIME % self.width] for (a, b), row in zip(self.hashes, self.rows))
+
+
+class HeavyHitters(object):
+    """The most frequent integers in a stream, at most size of them."""
+
+    def __init__(self, size, sketch=None):
+        self.size = size
+        self.sketch = CountMinSketch() if sketch is None else sketch
+        self.top = {}
+        # No more than the smallest count in self.top when it is full.
+        self.threshold = 0
+
+    def add(self, x):
+        est = self.sketch.add(x)
+        if x in self.top or len(self.top) < self.size:
+            self.top[x] = est
+        elif est > self.threshold:
+            y = min(self.top, key=self.top.get)
+            if est > self.top[y]:
+                del self.top[y]
+                self.top[x] = est
+            self.threshold = min(self.top.itervalues())
+
+    def items(self):
+        return self.top.items()
+
+
+def scores(observed, span, freq, total):
+    """Expected count, mutual information and log-likelihood.
+
+    observed: occurrences of the collocate within the windows,
+    span: number of words in the windows, freq: occurrences of the
+    collocate in the corpus, total: number of words in the corpus.
+    """
+    if total <= 0:
+        return None, None, None
+    expected = float(freq) * span / total
+    mi = None
+    if observed > 0 and expected > 0:
+        mi = math.log(observed / expected, 2)
+    # Contingency table: in windows or not, collocate or not.
+    o11 = observed
+    o12 = max(0, span - observed)
+    o21 = max(0, freq - observed)
+    o22 = max(0, total - span - o21)
+    n = float(o11 + o12 + o21 + o22)
+    ll = 0.0
+    for o, row, col in [
+        (o11, o11 + o12, o11 + o21),
+        (o12, o11 + o12, o12 + o22),
+        (o21, o21 + o22, o11 + o21),
+        (o22, o21 + o22, o12 + o22),
+    ]:
+        if o > 0:
+            ll += o * math.log(o * n / row / col)
+    return expected, mi, 2 * ll
+
+
+class Collocates(object):
+    """Words near the matches of one search."""
+
+    def __init__(self, size):
+        self.hitters = HeavyHitters(size)
+        self.span = 0
+
+    def add(self, ids):
+        # ids: the lemmas in the windows around the matches.
+        self.span += len(ids)
+        for x in ids:
+            self.hitters.add(x)
+
+    def results(self, freq, total):
+        """Return (id, observed, freq, expected, mi, ll) tuples.
+
+        Collocates that occur more often than expected come first,
+        the strongest association first.
+        """
+        result = []
+        for x, observed in self.hitters.items():
+            f = freq[x] if x < len(freq) else 0
+            expected, mi, ll = scores(observed, self.span, f, total)
+            result.append((x, observed, f, expected, mi, ll))
+        result.sort(key=lambda r: (r[1] <= r[3], -r[5], r[0]))
+        return result
+
+
+#### Unit tests
+
+
+class TestCollocates(unittest.TestCase):
+    def stream(self):
+        rnd = random.Random(1)
+        l = []
+        for i in xrange(20000):
+            # Skewed: small numbers are much more common.
+            l.append(int(rnd.paretovariate(1.2)))
+        return l
+
+    def test_sketch(self):
+        s = CountMinSketch(width=64)
+        l = self.stream()
+        counts = {}
+        for x in l:
+            s.add(x)
+            counts[x] = counts.get(x, 0) + 1
+        for x, n in counts.items():
+            self.assertTrue(s.estimate(x) >= n)
+            self.assertTrue(s.estimate(x) - n <= 3 * len(l) / 64)
+        s = CountMinSketch()
+        self.assertEqual([s.add(7), s.add(7), s.add(8), s.estimate(9)], [1, 2, 1, 0])
+
+    def test_heavy_hitters(self):
+        h = HeavyHitters(5)
+        l = self.stream()
+        for x in l:
+            h.add(x)
+        counts = {}
+        for x in l:
+            counts[x] = counts.get(x, 0) + 1
+        best = sorted(counts, key=lambda x: -counts[x])[:3]
+        self.assertEqual(len(h.items()), 5)
+        for x in best:
+            self.assertEqual(dict(h.items())[x], counts[x])
+
+    def test_scores(self):
+        expected, mi, ll = scores(10, 1000, 100, 100000)
+        self.assertAlmostEqual(expected, 1.0)
+        self.assertAlmostEqual(mi, math.log(10, 2))
+        table = [(10, 1.0), (990, 999.0), (90, 99.0), (98910, 98901.0)]
+        self.assertAlmostEqual(ll, 2 * sum(o * math.log(o / e) for o, e in table))
+        self.assertEqual(scores(0, 10, 5, 100)[1], None)
+        self.assertEqual(scores(0, 0, 0, 0), (None, None, None))
+        expected, mi, ll = scores(1, 100, 1000, 100000)
+        self.assertAlmostEqual(mi, 0.0)
+        self.assertAlmostEqual(ll, 0.0)
+
+    def test_collocates(self):
+        c = Collocates(10)
+        c.add([1, 2])
+        c.add([1, 3, 3, 4])
+        freq = array.array('l', [0, 2, 300, 3, 2])
+        r = c.results(freq, 1000)
+        self.assertEqual([x[:3] for x in r], [(1, 2, 2), (3, 2, 3), (4, 1, 2), (2, 1, 300)])
+        self.assertEqual(c.span, 6)
+
+
+if __name__ == u'__main__':
+    unittest.main()
@@ -1,12 +1,23 @@
 u"""Reading Konko configuration file."""
 
 import json
+import math
+import os
+import pickle
 import re
 import sys
+import tempfile
+import time
+import unittest
+import kphrase
 import kutil
 from io import open
 
 
+# Forget cached classifications when there are more distinct strings.
+CACHE_SIZE = 1000000
+
+
 class KConfig(object):
     def __init__(self, file):
         self.file = file
@@ -16,6 +27,8 @@ class KConfig(object):
         self.source = []
         self.skip_files = []
         self.search = []
+        self.search_rows = {}
+        self.phrase = []
         self.delete = []
         self.delete_pair = []
         self.compound_pair = []
@@ -29,6 +42,17 @@ class KConfig(object):
         self.encoding = u'ascii'
         self.context = 100
         self.server_port = 8000
+        self.daemon_port = 8001
+        self.cache_file_list = False
+        self.lazy_html = False
+        self.fragment_window = 1000
+        self.writer_threads = 4
+        self.duplicate_files = u'skip'
+        self.collocate_window = 0
+        self.collocate_count = 100
+        self.patterns = []
+        self.tag_cache = {}
+        self.search_cache = {}
         with open(file) as f:
             cfg = json.load(f)
             self.set_config([], cfg)        
@@ -50,6 +74,11 @@ class KConfig(object):
     def key_error(self, path, key):
         self.error(path, u'unsupported key "{}"'.format(key))
 
+    def regex(self, path, v, flags, kind):
+        r = kutil.safe_regex(v, flags)
+        self.patterns.append((u'.'.join([unicode(x) for x in path]), r, kind))
+        return r
+
     def get(self, path):
         p = []
         c = self.config
@@ -111,11 +140,41 @@ class KConfig(object):
             elif key == u'server-port':
                 self.expect(p, int, v)
                 self.server_port = v
+            elif key == u'daemon-port':
+                self.expect(p, int, v)
+                self.daemon_port = v
             elif key == u'search':
                 self.set_search(p, v)
+            elif key == u'phrase':
+                self.set_phrase(p, v)
             elif key == u'skip-files':
                 self.expect_string_list(p, v)
                 self.skip_files += v
+            elif key == u'collocate-window':
+                self.expect(p, int, v)
+                self.collocate_window = v
+            elif key == u'collocate-count':
+                self.expect(p, int, v)
+                if v <= 0:
+                    self.error(p, u'expected a positive number')
+                self.collocate_count = v
+            elif key == u'duplicate-files':
+                self.expect(p, unicode, v)
+                if v not in (u'skip', u'reuse'):
+                    self.error(p, u'expected "skip" or "reuse"')
+                self.duplicate_files = v
+            elif key == u'writer-threads':
+                self.expect(p, int, v)
+                self.writer_threads = v
+            elif key == u'fragment-window':
+                self.expect(p, int, v)
+                self.fragment_window = v
+            elif key == u'lazy-html':
+                self.expect(p, bool, v)
+                self.lazy_html = v
+            elif key == u'cache-file-list':
+                self.expect(p, bool, v)
+                self.cache_file_list = v
             elif key == u'tag-breaks-word':
                 self.expect(p, bool, v)
                 self.tag_breaks_word = v
@@ -128,16 +187,16 @@ class KConfig(object):
                 self.set_compound(p, v)
             elif key == u'text':
                 self.expect(p, unicode, v)
-                self.text = kutil.safe_regex(v, self.tag_flags)
+                self.text = self.regex(p, v, self.tag_flags, u'tag')
             elif key == u'sample':
                 self.expect(p, unicode, v)
-                self.sample = kutil.safe_regex(v, self.tag_flags)
+                self.sample = self.regex(p, v, self.tag_flags, u'tag')
             elif key == u'tag':
                 self.expect(p, unicode, v)
-                self.tag = kutil.safe_regex(v, self.tag_flags)
+                self.tag = self.regex(p, v, self.tag_flags, u'text')
             elif key == u'word':
                 self.expect(p, unicode, v)
-                self.word = kutil.safe_regex(v, self.word_flags)
+                self.word = self.regex(p, v, self.word_flags, u'text')
             else:
                 self.key_error(path0, key)
 
@@ -148,14 +207,71 @@ class KConfig(object):
             self.expect_string_list(p, val)
             self.source.append((key, val))
 
+    def set_rows(self, path, key, v, main):
+        # A search is either given directly or as an object with the
+        # search in key main and options for the concordance table.
+        max_rows = None
+        sample_rows = None
+        if isinstance(v, dict):
+            if main not in v:
+                self.error(path, u'missing key "{}"'.format(main))
+            for k, x in v.items():
+                if k in (u'max-rows', u'sample-rows'):
+                    self.expect(path + [k], int, x)
+                    if x < 0:
+                        self.error(path + [k], u'expected a non-negative number')
+                if k == u'max-rows':
+                    max_rows = x
+                elif k == u'sample-rows':
+                    sample_rows = x
+                elif k != main:
+                    self.key_error(path, k)
+            if max_rows is not None and sample_rows is not None:
+                self.error(path, u'max-rows and sample-rows cannot be used together')
+            path = path + [main]
+            v = v[main]
+        if key in self.search_rows:
+            self.error(path, u'search "{}" is already defined'.format(key))
+        self.search_rows[key] = (max_rows, sample_rows)
+        return path, v
+
     def set_search(self, path, v):
         self.expect(path, dict, v)
         for key, val in sorted(v.items()):
-            p = path + [key]
+            p, val = self.set_rows(path + [key], key, val, u're')
             self.expect(p, unicode, val)
-            re = kutil.safe_regex(val, self.search_flags)
+            re = self.regex(p, val, self.search_flags, u'word')
             self.search.append((key, re))
 
+    def set_phrase(self, path, v):
+        self.expect(path, dict, v)
+        for key, val in sorted(v.items()):
+            p, val = self.set_rows(path + [key], key, val, u'words')
+            self.expect(p, list, val)
+            patterns = []
+            gaps = []
+            gap = 0
+            for i, x in enumerate(val):
+                if isinstance(x, dict):
+                    if x.keys() != [u'gap']:
+                        self.error(p + [i], u'expected a pattern or {"gap": N}')
+                    self.expect(p + [i, u'gap'], int, x[u'gap'])
+                    if x[u'gap'] < 0:
+                        self.error(p + [i, u'gap'], u'expected a non-negative number')
+                    if len(patterns) == 0:
+                        self.error(p + [i], u'a phrase cannot start with a gap')
+                    gap += x[u'gap']
+                else:
+                    self.expect(p + [i], unicode, x)
+                    patterns.append(self.regex(p + [i], x, self.search_flags, u'word'))
+                    gaps.append(gap)
+                    gap = 0
+            if len(patterns) == 0:
+                self.error(p, u'expected at least one pattern')
+            if gap > 0:
+                self.error(p, u'a phrase cannot end with a gap')
+            self.phrase.append((key, kphrase.Phrase(patterns, gaps)))
+
     def set_delete(self, path, v):
         self.expect(path, list, v)
         for i, x in enumerate(v):
@@ -170,7 +286,7 @@ class KConfig(object):
 
     def set_delete_one(self, path, v):
         self.expect_string_list(path, v)
-        l = [kutil.safe_regex(x, self.tag_flags) for x in v]
+        l = [self.regex(path + [i], x, self.tag_flags, u'tag') for i, x in enumerate(v)]
         if len(l) == 1:
             self.delete.append(l[0])
         elif len(l) == 2:
@@ -180,8 +296,237 @@ class KConfig(object):
 
     def set_compound_one(self, path, v):
         self.expect_string_list(path, v)
-        l = [kutil.safe_regex(x, self.tag_flags) for x in v]
+        l = [self.regex(path + [i], x, self.tag_flags, u'tag') for i, x in enumerate(v)]
         if len(l) == 2:
             self.compound_pair.append(l)
         else:
             self.error(path, u'expected 2 elements')
+
+    def classify_tag(self, raw):
+        if raw in self.tag_cache:
+            return self.tag_cache[raw]
+        textkey = kutil.try_capture(self.text, raw)
+        samplekey = kutil.try_capture(self.sample, raw)
+        delete = False
+        for a in self.delete:
+            if kutil.exact_match(a, raw):
+                delete = True
+        pairs = {
+            "delete": self._try_pairs(self.delete_pair, raw),
+            "compound": self._try_pairs(self.compound_pair, raw),
+        }
+        c = (textkey, samplekey, delete, pairs)
+        if len(self.tag_cache) >= CACHE_SIZE:
+            self.tag_cache = {}
+        self.tag_cache[raw] = c
+        return c
+
+    def _try_pairs(self, pairs, raw):
+        p_open = []
+        p_close = []
+        for i, a in enumerate(pairs):
+            a1, a2 = a
+            if kutil.exact_match(a1, raw):
+                p_open.append(i)
+            if kutil.exact_match(a2, raw):
+                p_close.append(i)
+        return p_open, p_close
+
+    def match_search(self, word):
+        if word in self.search_cache:
+            return self.search_cache[word]
+        m = tuple(i for i, (key, r) in enumerate(self.search) if kutil.exact_match(r, word))
+        if len(self.search_cache) >= CACHE_SIZE:
+            self.search_cache = {}
+        self.search_cache[word] = m
+        return m
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['tag_cache'] = {}
+        state['search_cache'] = {}
+        return state
+
+
+def time_per_call(r, w, fn, repeat=3, clock=time.time):
+    # Repeat until the measurement is long enough to be meaningful,
+    # then take the best of several measurements to ignore noise.
+    n = 1
+    while True:
+        t0 = clock()
+        for i in xrange(n):
+            fn(r, w)
+        t = clock() - t0
+        if t >= 0.001 or n >= 1000000:
+            break
+        n *= 4
+    best = t
+    for j in xrange(repeat - 1):
+        t0 = clock()
+        for i in xrange(n):
+            fn(r, w)
+        best = min(best, clock() - t0)
+    return best / n
+
+
+def growth(times):
+    """Least-squares slope of log(time) against log(length)."""
+    points = [(math.log(n), math.log(t)) for n, t in times if t > 0]
+    if len(points) < 2:
+        return 0.0
+    mx = sum(x for x, y in points) / len(points)
+    my = sum(y for x, y in points) / len(points)
+    sxx = sum((x - mx) ** 2 for x, y in points)
+    if sxx == 0:
+        return 0.0
+    return sum((x - mx) * (y - my) for x, y in points) / sxx
+
+
+def _match(r, w):
+    return kutil.exact_match(r, w)
+
+
+def _search(r, w):
+    return r.search(w)
+
+
+def check_pattern(r, kind, samples, maxlen=1000, limit=0.05, timer=time_per_call):
+    """Time a regular expression on sample strings and on long strings.
+
+    Returns the mean time per sample in seconds, the worst exponent k
+    such that the time per call grows like length ** k, and the time
+    per call at the longest length for that exponent. Linear-time
+    patterns have k close to 1, and backtracking patterns much more.
+    """
+    fn = _search if kind == u'text' else _match
+    if len(samples) > 0:
+        t0 = time.time()
+        for w in samples:
+            fn(r, w)
+        mean = (time.time() - t0) / len(samples)
+    else:
+        mean = 0.0
+    chars = set(c for c in r.pattern if c.isalnum())
+    chars.add(u'a')
+    seeds = sorted(chars)
+    if len(samples) > 0:
+        seeds.append(u' '.join(samples))
+    worst = (0.0, 0.0)
+    for seed in seeds:
+        n = 8
+        times = []
+        while n <= maxlen:
+            w = (seed * (n // len(seed) + 1))[:n]
+            t = timer(r, w, fn)
+            times.append((n, t))
+            if t > limit:
+                break
+            n += max(4, n // 4)
+        # Fit over the longest lengths, down to a sixteenth of the longest.
+        n1, t1 = times[-1]
+        k = growth([(n, t) for n, t in times if 16 * n >= n1])
+        worst = max(worst, (k, t1))
+    return mean, worst[0], worst[1]
+
+
+#### Unit tests
+
+
+class TestKConfig(unittest.TestCase):
+    CONFIG = u"""{
+        "source": {"x": ["x.txt"]},
+        "search": {"ness": ".*ness", "ity": {"re": ".*ity", "sample-rows": 10}},
+        "phrase": {"of": {"words": ["the", ".*ness", {"gap": 2}, "of"], "max-rows": 5}},
+        "tag": "<[^<>]+>",
+        "delete": [["<X>"], ["<O>", "</O>"]],
+        "compound": [["<w>", "</w>"]],
+        "text": "<T ([^<>]+)>",
+        "sample": "<S ([^<>]+)>",
+        "search-ignore-case": true
+    }"""
+
+    def setUp(self):
+        fd, self.file = tempfile.mkstemp(u'.json')
+        os.close(fd)
+        with open(self.file, u'w') as f:
+            f.write(self.CONFIG)
+        self.cfg = KConfig(self.file)
+
+    def tearDown(self):
+        os.remove(self.file)
+
+    def test_classify_tag(self):
+        e = {"delete": ([], []), "compound": ([], [])}
+        for i in xrange(2):
+            self.assertEqual(self.cfg.classify_tag(u'<T a>'), ((u'a',), None, False, e))
+            self.assertEqual(self.cfg.classify_tag(u'<S b>'), (None, (u'b',), False, e))
+            self.assertEqual(self.cfg.classify_tag(u'<X>'), (None, None, True, e))
+            self.assertEqual(self.cfg.classify_tag(u'</O>'),
+                (None, None, False, {"delete": ([], [0]), "compound": ([], [])}))
+            self.assertEqual(self.cfg.classify_tag(u'<w>'),
+                (None, None, False, {"delete": ([], []), "compound": ([0], [])}))
+
+    def test_match_search(self):
+        self.assertEqual([k for k, r in self.cfg.search], [u'ity', u'ness'])
+        for i in xrange(2):
+            self.assertEqual(self.cfg.match_search(u'Goodness'), (1,))
+            self.assertEqual(self.cfg.match_search(u'city'), (0,))
+            self.assertEqual(self.cfg.match_search(u'nessity'), (0,))
+            self.assertEqual(self.cfg.match_search(u'good'), ())
+
+    def test_pickle(self):
+        self.cfg.match_search(u'city')
+        cfg = pickle.loads(pickle.dumps(self.cfg, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(cfg.search_cache, {})
+        self.assertEqual(cfg.match_search(u'city'), (0,))
+        self.assertEqual(cfg.classify_tag(u'<T a>')[0], (u'a',))
+
+    def test_patterns(self):
+        names = sorted(name for name, r, kind in self.cfg.patterns)
+        self.assertEqual(names, [
+            u'compound.0.0', u'compound.0.1', u'delete.0.0', u'delete.1.0', u'delete.1.1',
+            u'phrase.of.words.0', u'phrase.of.words.1', u'phrase.of.words.3',
+            u'sample', u'search.ity.re', u'search.ness', u'tag', u'text',
+        ])
+
+    def test_search_rows(self):
+        self.assertEqual(self.cfg.search_rows, {
+            u'ity': (None, 10), u'ness': (None, None), u'of': (5, None),
+        })
+
+    def test_phrase(self):
+        key, phrase = self.cfg.phrase[0]
+        self.assertEqual(key, u'of')
+        self.assertEqual(phrase.gaps, [0, 0, 2])
+        self.assertEqual(phrase.patterns[1].pattern, u'.*ness')
+
+    def test_growth(self):
+        self.assertAlmostEqual(growth([(10, 2.0), (20, 4.0), (40, 8.0)]), 1.0)
+        self.assertAlmostEqual(growth([(10, 1.0), (20, 8.0)]), 3.0)
+        self.assertEqual(growth([(10, 1.0)]), 0.0)
+
+    def test_check_pattern(self):
+        # Deterministic timings: time grows like length ** k.
+        for k in (1, 3):
+            lengths = []
+
+            def timer(r, w, fn):
+                lengths.append(len(w))
+                return 1e-7 * len(w) ** k
+
+            mean, growth_k, t = check_pattern(re.compile(u'.*ness'), u'word', [u'goodness'], 300, timer=timer)
+            self.assertAlmostEqual(growth_k, k)
+            self.assertAlmostEqual(t, 1e-7 * max(lengths) ** k)
+        # The time per call is the best of the repeats.
+        ticks = iter([0, 5, 10, 12, 20, 23])
+        self.assertEqual(time_per_call(None, None, lambda r, w: None, 3, lambda: next(ticks)), 2)
+
+    def test_backtracking(self):
+        # Exponential backtracking is far beyond any noise in timing.
+        mean, k, t = check_pattern(re.compile(u'(a+)+b'), u'word', [u'aab'], 300)
+        self.assertTrue(k > 2)
+        self.assertTrue(t > 0.01)
+
+
+if __name__ == u'__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+u"""Answering search requests against a corpus kept in memory."""
+
+import BaseHTTPServer
+import SocketServer
+import os
+import re
+import tempfile
+import unittest
+import urllib
+import urlparse
+from io import open
+
+
+XLSX_TYPE = u'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+USAGE = u'''Konko daemon. Requests:
+
+/search?re=PATTERN          concordance and counts, tab-separated
+/search.xlsx?re=PATTERN     the same as an Excel file
+/SOURCE/TEXT.html?re=PATTERN  text with matches highlighted
+'''
+
+
+def tsv_value(kind, v):
+    if v is None:
+        return u''
+    elif kind == u"rich":
+        return u''.join(txt for fmt, txt in v)
+    else:
+        return unicode(v).replace(u'\t', u' ').replace(u'\n', u' ')
+
+
+def tsv(values):
+    return u'\t'.join(tsv_value(kind, v) for kind, v in values) + u'\n'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        path = urllib.unquote(url.path).decode(u'utf-8')
+        query = urlparse.parse_qs(url.query)
+        pattern = query.get(u're', [None])[0]
+        if pattern is not None:
+            pattern = pattern.decode(u'utf-8')
+        if path == u'/':
+            self.send_text(200, USAGE)
+            return
+        text = None
+        if path not in (u'/search', u'/search.xlsx'):
+            text = self.server.conc.find_text(path)
+            if text is None:
+                self.send_text(404, u'not found: {}\n'.format(path))
+                return
+        elif pattern is None:
+            self.send_text(400, u'missing parameter: re\n')
+            return
+        try:
+            q = self.server.conc.query(pattern)
+        except re.error as e:
+            self.send_text(400, u'error parsing regex: {}: {}\n'.format(pattern, e))
+            return
+        if text is not None:
+            self.send_data(200, u'text/html; charset=utf-8', q.page(text).encode(u'utf-8'))
+        elif path == u'/search':
+            self.send_search(q)
+        else:
+            self.send_workbook(q)
+
+    def send_data(self, code, content_type, data, headers=()):
+        self.send_response(code)
+        self.send_header(u'Content-type', content_type)
+        self.send_header(u'Content-Length', unicode(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_text(self, code, msg):
+        self.send_data(code, u'text/plain; charset=utf-8', msg.encode(u'utf-8'))
+
+    def send_search(self, q):
+        # Rows are written as soon as each text has been searched.
+        self.send_response(200)
+        self.send_header(u'Content-type', u'text/tab-separated-values; charset=utf-8')
+        self.end_headers()
+        out = self.wfile
+        out.write(u'\t'.join(col[0] for col in q.get_columns()).encode(u'utf-8') + b'\n')
+        n = 0
+        counts = []
+        types = set()
+        for text in q.texts():
+            for word, ctx in q.matches(text):
+                n += 1
+                out.write(tsv(q.row(n, word, text, ctx)).encode(u'utf-8'))
+            # Only the numbers are kept until the summary is written.
+            counter = q.count(text)
+            ids = counter.distinct()
+            types.update(ids)
+            counts.append((text, counter.total, len(ids)))
+            out.flush()
+        out.write(b'\n')
+        cols = [col[0] for col in q.get_text_columns()]
+        out.write(u'\t'.join(cols).encode(u'utf-8') + b'\n')
+        words = 0
+        tokens = 0
+        for text, total, text_types in counts:
+            out.write(tsv([
+                (u"url", q.text_link(text)),
+                (u"string", text.file.source.key),
+                (u"string", text.file.shortname),
+                (u"string", text.name),
+                (u"number", len(text.words)),
+                (u"number", total),
+                (u"number", text_types),
+            ]).encode(u'utf-8'))
+            words += len(text.words)
+            tokens += total
+        out.write(tsv([
+            (u"string", u"Total"), (u"string", None), (u"string", None), (u"string", None),
+            (u"number", words), (u"number", tokens), (u"number", len(types)),
+        ]).encode(u'utf-8'))
+
+    def send_workbook(self, q):
+        fd, filename = tempfile.mkstemp(u'.xlsx')
+        os.close(fd)
+        try:
+            q.workbook(filename)
+            with open(filename, u'rb') as f:
+                data = f.read()
+        finally:
+            os.remove(filename)
+        self.send_data(200, XLSX_TYPE, data, [
+            (u'Content-Disposition', u'attachment; filename="query.xlsx"'),
+        ])
+
+
+class Server(SocketServer.TCPServer):
+    allow_reuse_address = True
+
+
+def serve(conc, port):
+    httpd = Server((u"localhost", port), Handler)
+    httpd.conc = conc
+    print u'Daemon started, hit ctrl-c to stop.'
+    print u'Send search requests to {}/search?re=PATTERN'.format(conc.url)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print u'\nStop.'
+
+
+#### Unit tests
+
+
+class TestTsv(unittest.TestCase):
+    def test_tsv(self):
+        self.assertEqual(tsv([]), u'\n')
+        self.assertEqual(tsv([
+            (u"number", 12),
+            (u"rich", [(u"normal", u"a "), (u"hl", u"b")]),
+            (u"string", u"c\td\ne"),
+            (u"string", None),
+            (u"url", u"http://x/#y"),
+        ]), u'12\ta b\tc d e\t\thttp://x/#y\n')
+
+
+if __name__ == u'__main__':
+    unittest.main()
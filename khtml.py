@@ -0,0 +1,406 @@
+u"""Rendering texts as HTML, now or on demand."""
+
+import cgi
+import collections
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urlparse
+import kstyle
+from io import open
+
+
+HEAD = u'''<!DOCTYPE html>
+<html lang="en">
+<head>
+<title>{}</title>
+<meta charset="UTF-8">
+<style>
+{}
+</style>
+</head>
+<body>
+{}<pre>'''
+
+FOOT = u'''</pre>
+{}</body>
+</html>
+'''
+
+# Served instead of a long text; turns the anchor into a query. Without
+# an anchor, the blank around selects the beginning of the text.
+STUB = u'''<!DOCTYPE html>
+<html lang="en">
+<head>
+<title>{}</title>
+<meta charset="UTF-8">
+<script>
+if (location.hash) {{
+location.replace("?around=" + encodeURIComponent(location.hash.substring(1)) + location.hash);
+}} else {{
+location.replace("?around=");
+}}
+</script>
+</head>
+<body>
+<p><a href="?full=1">{}</a></p>
+</body>
+</html>
+'''
+
+DATA_FILE = u'texts.jsonl'
+INDEX_FILE = u'texts.json'
+
+# Byte offset of every CHECKPOINT-th compound is kept in the index.
+CHECKPOINT = 256
+
+
+# A compound is recorded as (anchor, tokens), where anchor is the
+# HTML id of a matching compound or None, and tokens is a list of
+# (class string, printable text) pairs.
+
+def write_compound(f, record):
+    anchor, tokens = record
+    if anchor is not None:
+        f.write(u'<span class="c" id="')
+        f.write(cgi.escape(anchor, quote=True))
+        f.write(u'">')
+    else:
+        f.write(u'<span class="c">')
+    for class_string, text in tokens:
+        f.write(u'<span class="')
+        f.write(cgi.escape(class_string, quote=True))
+        f.write(u'">')
+        f.write(cgi.escape(text, quote=False))
+        f.write(u'</span>')
+    f.write(u'</span>')
+
+
+def write_text(f, title, records, nav_before=u'', nav_after=u''):
+    f.write(HEAD.format(
+        cgi.escape(title, quote=False),
+        cgi.escape(kstyle.css, quote=False),
+        nav_before
+    ))
+    for record in records:
+        write_compound(f, record)
+    f.write(FOOT.format(nav_after))
+
+
+class _Buffer(object):
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+
+    def getvalue(self):
+        return u''.join(self.parts)
+
+
+def render(title, records, nav_before=u'', nav_after=u''):
+    f = _Buffer()
+    write_text(f, title, records, nav_before, nav_after)
+    return f.getvalue()
+
+
+def render_stub(title):
+    return STUB.format(cgi.escape(title, quote=False), u'full text')
+
+
+def _nav(around, window, what):
+    query = u'?around={}&window={}#{}'.format(around, 2 * window, around)
+    return u'<p><a href="{}">{}</a> | <a href="?full=1">full text</a></p>\n'.format(
+        cgi.escape(query, quote=True), what
+    )
+
+
+class StoreWriter(object):
+    """Storing the compounds of texts for rendering later."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self.f = open(os.path.join(path, DATA_FILE), u'wb')
+
+    def write_text(self, htmlfile, title, records):
+        start = self.f.tell()
+        checkpoints = []
+        anchors = {}
+        count = 0
+        for record in records:
+            if count % CHECKPOINT == 0:
+                checkpoints.append(self.f.tell() - start)
+            if record[0] is not None:
+                anchors[record[0]] = count
+            self.f.write(json.dumps(record, separators=(',', ':')))
+            self.f.write(b'\n')
+            count += 1
+        length = self.f.tell() - start
+        self.index[htmlfile] = [title, start, length, count, checkpoints, anchors]
+
+    def close(self):
+        self.f.close()
+        with open(os.path.join(self.path, INDEX_FILE), u'w') as f:
+            f.write(unicode(json.dumps(self.index)))
+
+
+class StoreReader(object):
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+
+    def records(self, htmlfile, a=0, b=None):
+        title, start, length, count, checkpoints, anchors = self.index[htmlfile]
+        if b is None:
+            b = count
+        k = a // CHECKPOINT
+        kb = (b + CHECKPOINT - 1) // CHECKPOINT
+        lo = checkpoints[k] if k < len(checkpoints) else length
+        hi = checkpoints[kb] if kb < len(checkpoints) else length
+        with open(os.path.join(self.path, DATA_FILE), u'rb') as f:
+            f.seek(start + lo)
+            data = f.read(hi - lo)
+        lines = data.splitlines()[a - k * CHECKPOINT:b - k * CHECKPOINT]
+        return [json.loads(line) for line in lines]
+
+    def render(self, htmlfile, around=None, window=0, full=False):
+        if htmlfile not in self.index:
+            return None
+        title, start, length, count, checkpoints, anchors = self.index[htmlfile]
+        if full or window <= 0 or count <= 2 * window + 1:
+            return render(title, self.records(htmlfile))
+        if around is None:
+            return render_stub(title)
+        i = anchors.get(around, 0)
+        a = max(0, i - window)
+        b = min(count, i + window + 1)
+        nav_before = _nav(around, window, u'show more') if a > 0 else u''
+        nav_after = _nav(around, window, u'show more') if b < count else u''
+        return render(title, self.records(htmlfile, a, b), nav_before, nav_after)
+
+
+def store_version(path):
+    """Return the (mtime, size) of the index in path, or None."""
+    try:
+        st = os.stat(os.path.join(path, INDEX_FILE))
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def remove_pages(path):
+    # Pages left by an earlier run would be served instead of the store.
+    for name in os.listdir(path):
+        if name.endswith(u'.html'):
+            os.remove(os.path.join(path, name))
+
+
+def remove_store(path):
+    for name in DATA_FILE, INDEX_FILE:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+
+
+def parse_query(query):
+    """Return the around, window and full arguments in a URL query.
+
+    A blank around is kept: it asks for the first window, whereas
+    a missing one makes StoreReader.render return the stub.
+    """
+    q = urlparse.parse_qs(query, keep_blank_values=True)
+    around = q.get(u'around', [None])[0]
+    full = u'full' in q
+    try:
+        window = int(q[u'window'][0])
+    except (KeyError, ValueError):
+        window = None
+    return around, window, full
+
+
+class PageCache(object):
+    """Rendering pages on demand, keeping the most recent ones.
+
+    The index is checked on each request; when konko has written the
+    store again, the old reader and its pages are dropped.
+    """
+
+    def __init__(self, size, window=0):
+        self.size = size
+        self.window = window
+        self.pages = collections.OrderedDict()
+        # path -> (version, StoreReader)
+        self.stores = {}
+
+    def get(self, filename, around=None, window=None, full=False):
+        if window is None:
+            window = self.window
+        path, htmlfile = os.path.split(filename)
+        version = store_version(path)
+        if version is None:
+            self.drop(path)
+            return None
+        if path in self.stores and self.stores[path][0] != version:
+            self.drop(path)
+        key = (filename, around, window, full)
+        if key in self.pages:
+            page = self.pages.pop(key)
+            self.pages[key] = page
+            return page
+        if path not in self.stores:
+            self.stores[path] = (version, StoreReader(path))
+        page = self.stores[path][1].render(htmlfile, around, window, full)
+        if page is None:
+            return None
+        self.pages[key] = page
+        while len(self.pages) > self.size:
+            self.pages.popitem(last=False)
+        return page
+
+    def drop(self, path):
+        self.stores.pop(path, None)
+        for key in [k for k in self.pages if os.path.dirname(k[0]) == path]:
+            del self.pages[key]
+
+
+#### Unit tests
+
+
+class TestKHtml(unittest.TestCase):
+    RECORDS = [
+        (None, [(u'w', u'a<b')]),
+        (u'l1c4', [(u's', u' '), (u't d', u'<x>'), (u'w m', u'c"d')]),
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_compound(self):
+        f = _Buffer()
+        for record in self.RECORDS:
+            write_compound(f, record)
+        self.assertEqual(f.getvalue(),
+            u'<span class="c"><span class="w">a&lt;b</span></span>'
+            u'<span class="c" id="l1c4"><span class="s"> </span>'
+            u'<span class="t d">&lt;x&gt;</span><span class="w m">c"d</span></span>')
+
+    def test_store(self):
+        w = StoreWriter(self.dir)
+        w.write_text(u'a.html', u'A & B', self.RECORDS)
+        w.write_text(u'b.html', u'\xe4', [(None, [(u'w', u'\xe4\n')])])
+        w.write_text(u'c.html', u'C', [])
+        w.close()
+        r = StoreReader(self.dir)
+        self.assertEqual(r.render(u'a.html'), render(u'A & B', self.RECORDS))
+        self.assertEqual(r.render(u'b.html'), render(u'\xe4', [(None, [(u'w', u'\xe4\n')])]))
+        self.assertEqual(r.render(u'c.html'), render(u'C', []))
+        self.assertEqual(r.render(u'd.html'), None)
+
+    def test_cache(self):
+        w = StoreWriter(self.dir)
+        for x in u'abc':
+            w.write_text(x + u'.html', x, self.RECORDS)
+        w.close()
+        c = PageCache(2)
+        a = c.get(os.path.join(self.dir, u'a.html'))
+        self.assertEqual(a, render(u'a', self.RECORDS))
+        c.get(os.path.join(self.dir, u'b.html'))
+        c.get(os.path.join(self.dir, u'a.html'))
+        c.get(os.path.join(self.dir, u'c.html'))
+        self.assertEqual([k[0] for k in c.pages.keys()], [
+            os.path.join(self.dir, u'a.html'),
+            os.path.join(self.dir, u'c.html'),
+        ])
+        self.assertEqual(c.get(os.path.join(self.dir, u'x.html')), None)
+        self.assertEqual(c.get(os.path.join(self.dir, u'sub', u'a.html')), None)
+
+    def test_stale(self):
+        w = StoreWriter(self.dir)
+        w.write_text(u'a.html', u'a', self.RECORDS)
+        w.close()
+        c = PageCache(2)
+        a = os.path.join(self.dir, u'a.html')
+        self.assertEqual(c.get(a), render(u'a', self.RECORDS))
+        w = StoreWriter(self.dir)
+        w.write_text(u'a.html', u'new', self.RECORDS[:1])
+        w.write_text(u'b.html', u'b', self.RECORDS)
+        w.close()
+        # Make sure the index looks different even within one second.
+        t = os.stat(os.path.join(self.dir, INDEX_FILE)).st_mtime
+        os.utime(os.path.join(self.dir, INDEX_FILE), (t + 10, t + 10))
+        self.assertEqual(c.get(a), render(u'new', self.RECORDS[:1]))
+        self.assertEqual(c.get(os.path.join(self.dir, u'b.html')), render(u'b', self.RECORDS))
+        remove_store(self.dir)
+        self.assertEqual(c.get(a), None)
+        self.assertEqual(len(c.pages), 0)
+
+    def test_no_anchor(self):
+        # A link without an anchor gets the stub, and the stub asks for
+        # the first window instead of the stub again.
+        records = [(u'l{}c1'.format(i), [(u'w', unicode(i))]) for i in xrange(100)]
+        w = StoreWriter(self.dir)
+        w.write_text(u'a.html', u'A', records)
+        w.close()
+        c = PageCache(10, 10)
+        a = os.path.join(self.dir, u'a.html')
+        self.assertEqual(c.get(a, *parse_query(u'')), render_stub(u'A'))
+        self.assertIn(u'location.replace("?around=");', render_stub(u'A'))
+        page = c.get(a, *parse_query(u'around='))
+        self.assertNotEqual(page, render_stub(u'A'))
+        self.assertIn(u'>10<', page)
+        self.assertNotIn(u'>11<', page)
+        self.assertEqual(parse_query(u'around=l5c1&window=4'), (u'l5c1', 4, False))
+        self.assertEqual(parse_query(u'full=1&window=x'), (None, None, True))
+
+    def test_remove(self):
+        for name in u'a.html', u'b.html', u'x.txt':
+            with open(os.path.join(self.dir, name), u'w') as f:
+                f.write(u'x')
+        remove_pages(self.dir)
+        self.assertEqual(os.listdir(self.dir), [u'x.txt'])
+        remove_store(self.dir)
+        w = StoreWriter(self.dir)
+        w.close()
+        remove_store(self.dir)
+        self.assertEqual(os.listdir(self.dir), [u'x.txt'])
+
+    def test_fragment(self):
+        n = 1000
+        records = []
+        for i in xrange(n):
+            anchor = u'l{}c1'.format(i) if i % 10 == 0 else None
+            records.append((anchor, [(u'w', unicode(i))]))
+        w = StoreWriter(self.dir)
+        w.write_text(u'a.html', u'A', records)
+        w.write_text(u'b.html', u'B', records[:5])
+        w.close()
+        r = StoreReader(self.dir)
+        for a, b in [(0, 0), (0, n), (0, 256), (255, 257), (300, 520), (999, n), (n, n)]:
+            self.assertEqual(r.records(u'a.html', a, b), [[x, [list(y) for y in z]] for x, z in records[a:b]])
+        self.assertEqual(r.render(u'a.html', window=0), render(u'A', records))
+        self.assertEqual(r.render(u'a.html', window=100, full=True), render(u'A', records))
+        self.assertEqual(r.render(u'b.html', window=2), render(u'B', records[:5]))
+        self.assertEqual(r.render(u'a.html', window=100), render_stub(u'A'))
+        page = r.render(u'a.html', u'l500c1', 100)
+        self.assertIn(u'id="l500c1"', page)
+        self.assertIn(u'>400<', page)
+        self.assertNotIn(u'>399<', page)
+        self.assertIn(u'>600<', page)
+        self.assertNotIn(u'>601<', page)
+        self.assertIn(u'href="?around=l500c1&amp;window=200#l500c1"', page)
+        page = r.render(u'a.html', u'l0c1', 100)
+        self.assertEqual(page.count(u'show more'), 1)
+        page = r.render(u'a.html', u'', 100)
+        self.assertEqual(page.count(u'show more'), 1)
+        self.assertIn(u'>100<', page)
+        self.assertNotIn(u'>101<', page)
+
+
+if __name__ == u'__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+u"""Finding sequences of words, with optional gaps between them."""
+
+import collections
+import re
+import unittest
+import kutil
+
+
+def position_index(form_ids):
+    """Map each form id to its positions in form_ids."""
+    index = collections.defaultdict(list)
+    for p, f in enumerate(form_ids):
+        index[f].append(p)
+    return index
+
+
+class Phrase(object):
+    """A sequence of word patterns.
+
+    gaps[k] is the largest number of other words allowed between the
+    words matching patterns k-1 and k; gaps[0] is always zero.
+    """
+
+    def __init__(self, patterns, gaps):
+        assert len(patterns) > 0
+        assert len(patterns) == len(gaps) and gaps[0] == 0
+        self.patterns = patterns
+        self.gaps = gaps
+        # For each pattern, form id -> whether the form matches.
+        self.known = [{} for r in patterns]
+
+    def accepts(self, k, form_id, lexicon):
+        known = self.known[k]
+        if form_id not in known:
+            known[form_id] = kutil.exact_match(self.patterns[k], lexicon.string(form_id))
+        return known[form_id]
+
+    def find(self, form_ids, lexicon, index=None):
+        """Return (first, last) positions of the matches in form_ids.
+
+        There is at most one match starting at each position: the
+        shortest one. Only the positions around the occurrences of the
+        rarest pattern are tried. The index from position_index can be
+        shared by all phrases searched in the same text.
+        """
+        if index is None:
+            index = position_index(form_ids)
+        rarest = None
+        for k in xrange(len(self.patterns)):
+            found = [l for f, l in index.iteritems() if self.accepts(k, f, lexicon)]
+            n = sum(len(l) for l in found)
+            if n == 0:
+                return []
+            if rarest is None or n < rarest[0]:
+                rarest = (n, k, found)
+        n, k, found = rarest
+        before_min = k
+        before_max = k + sum(self.gaps[1:k + 1])
+        starts = set()
+        for l in found:
+            for p in l:
+                starts.update(xrange(max(0, p - before_max), p - before_min + 1))
+        result = []
+        for s in sorted(starts):
+            e = self._match_from(s, form_ids, lexicon)
+            if e is not None:
+                result.append((s, e))
+        return result
+
+    def _match_from(self, s, form_ids, lexicon):
+        # Simulate the automaton: the set of positions where the
+        # previous pattern may have matched.
+        if not self.accepts(0, form_ids[s], lexicon):
+            return None
+        active = [s]
+        for k in xrange(1, len(self.patterns)):
+            following = set()
+            for p in active:
+                for q in xrange(p + 1, min(len(form_ids), p + 2 + self.gaps[k])):
+                    if self.accepts(k, form_ids[q], lexicon):
+                        following.add(q)
+            if len(following) == 0:
+                return None
+            active = sorted(following)
+        return active[0]
+
+
+#### Unit tests
+
+
+class TestPhrase(unittest.TestCase):
+    def find(self, patterns, gaps, words):
+        lexicon = kutil.Lexicon()
+        form_ids = [lexicon.get(w) for w in words.split()]
+        phrase = Phrase([re.compile(p) for p in patterns], gaps)
+        return phrase.find(form_ids, lexicon)
+
+    def test_find(self):
+        words = u'the goodness of the great kindness of x the of'
+        self.assertEqual(self.find([u'the', u'.*ness', u'of'], [0, 0, 0], words), [(0, 2)])
+        self.assertEqual(self.find([u'the', u'.*ness', u'of'], [0, 1, 0], words), [(0, 2), (3, 6)])
+        self.assertEqual(self.find([u'the', u'of'], [0, 3], words), [(0, 2), (3, 6), (8, 9)])
+        self.assertEqual(self.find([u'of'], [0], words), [(2, 2), (6, 6), (9, 9)])
+        self.assertEqual(self.find([u'the', u'none'], [0, 5], words), [])
+        self.assertEqual(self.find([u'x'], [0], u''), [])
+
+    def test_shared_index(self):
+        lexicon = kutil.Lexicon()
+        form_ids = [lexicon.get(w) for w in u'a b a c'.split()]
+        index = position_index(form_ids)
+        self.assertEqual(dict(index), {0: [0, 2], 1: [1], 2: [3]})
+        ab = Phrase([re.compile(u'a'), re.compile(u'b')], [0, 0])
+        ac = Phrase([re.compile(u'a'), re.compile(u'c')], [0, 1])
+        self.assertEqual(ab.find(form_ids, lexicon, index), [(0, 1)])
+        self.assertEqual(ac.find(form_ids, lexicon, index), [(2, 3)])
+
+    def test_shortest(self):
+        # A start position yields one match, ending as early as possible.
+        self.assertEqual(self.find([u'a', u'b'], [0, 2], u'a b b a'), [(0, 1)])
+        self.assertEqual(self.find([u'a', u'a'], [0, 2], u'a a a'), [(0, 1), (1, 2)])
+
+    def test_rarest(self):
+        # The anchor is the last pattern; starts are found before it.
+        words = u' '.join([u'a'] * 50 + [u'b', u'c', u'z'])
+        self.assertEqual(self.find([u'a', u'b', u'.', u'z'], [0, 1, 0, 0], words), [(48, 52), (49, 52)])
+
+
+if __name__ == u'__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+u"""Frequency and dispersion statistics."""
+
+import array
+import math
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class FrequencyMatrix(object):
+    """Counts of each search in each part (text or sample) of the corpus."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.words = array.array('l')
+        self.counts = array.array('l')
+
+    def add(self, words, counts):
+        assert len(counts) == self.columns
+        self.words.append(words)
+        self.counts.extend(counts)
+
+    def rows(self):
+        return len(self.words)
+
+    def stats(self):
+        """For each column, return a dictionary of statistics.
+
+        Parts without any words are ignored. Keys: tokens, words,
+        per_million, range, parts, juilland_d, dp. Values that are not
+        defined for the data are None.
+        """
+        if numpy is not None:
+            return _stats_numpy(self)
+        else:
+            return _stats_python(self)
+
+
+def _result(tokens, words, nonzero, parts, d, dp):
+    return {
+        u"tokens": tokens,
+        u"words": words,
+        u"per_million": 1e6 * tokens / words if words > 0 else None,
+        u"range": nonzero,
+        u"parts": parts,
+        u"juilland_d": d,
+        u"dp": dp,
+    }
+
+
+def _stats_numpy(m):
+    words = numpy.frombuffer(m.words, dtype=numpy.dtype(m.words.typecode)).astype(float)
+    counts = numpy.frombuffer(m.counts, dtype=numpy.dtype(m.counts.typecode)).astype(float)
+    counts = counts.reshape((len(words), m.columns))
+    keep = words > 0
+    words = words[keep]
+    counts = counts[keep]
+    n = len(words)
+    total_words = words.sum()
+    tokens = counts.sum(axis=0)
+    nonzero = (counts > 0).sum(axis=0)
+    result = []
+    if n > 0:
+        rel = counts / words[:, numpy.newaxis]
+        mean = rel.mean(axis=0)
+        sd = rel.std(axis=0)
+        expected = words / total_words
+    for j in xrange(m.columns):
+        d = None
+        dp = None
+        if n > 1 and mean[j] > 0:
+            d = 1.0 - sd[j] / mean[j] / math.sqrt(n - 1)
+        if tokens[j] > 0:
+            dp = 0.5 * numpy.abs(counts[:, j] / tokens[j] - expected).sum()
+        result.append(_result(int(tokens[j]), int(total_words), int(nonzero[j]), n, d, dp))
+    return result
+
+
+def _stats_python(m):
+    rows = []
+    for i, w in enumerate(m.words):
+        if w > 0:
+            rows.append((w, m.counts[i * m.columns:(i + 1) * m.columns]))
+    n = len(rows)
+    total_words = sum(w for w, c in rows)
+    result = []
+    for j in xrange(m.columns):
+        tokens = sum(c[j] for w, c in rows)
+        nonzero = sum(1 for w, c in rows if c[j] > 0)
+        d = None
+        dp = None
+        if n > 1:
+            rel = [float(c[j]) / w for w, c in rows]
+            mean = sum(rel) / n
+            if mean > 0:
+                sd = math.sqrt(sum((x - mean) ** 2 for x in rel) / n)
+                d = 1.0 - sd / mean / math.sqrt(n - 1)
+        if tokens > 0:
+            dp = 0.5 * sum(abs(float(c[j]) / tokens - float(w) / total_words) for w, c in rows)
+        result.append(_result(tokens, total_words, nonzero, n, d, dp))
+    return result
+
+
+#### Unit tests
+
+
+class TestStats(unittest.TestCase):
+    def matrix(self):
+        m = FrequencyMatrix(3)
+        m.add(100, [1, 0, 2])
+        m.add(0, [0, 0, 0])
+        m.add(300, [3, 0, 0])
+        m.add(100, [1, 0, 0])
+        return m
+
+    def check(self, result):
+        self.assertEqual(len(result), 3)
+        a, b, c = result
+        self.assertEqual(a[u"tokens"], 5)
+        self.assertEqual(a[u"words"], 500)
+        self.assertEqual(a[u"parts"], 3)
+        self.assertAlmostEqual(a[u"per_million"], 10000.0)
+        # Evenly spread: perfect dispersion
+        self.assertEqual(a[u"range"], 3)
+        self.assertAlmostEqual(a[u"juilland_d"], 1.0)
+        self.assertAlmostEqual(a[u"dp"], 0.0)
+        # No occurrences
+        self.assertEqual(b[u"tokens"], 0)
+        self.assertEqual(b[u"range"], 0)
+        self.assertEqual(b[u"juilland_d"], None)
+        self.assertEqual(b[u"dp"], None)
+        # Everything in one part
+        self.assertEqual(c[u"range"], 1)
+        self.assertAlmostEqual(c[u"dp"], 0.8)
+        rel = [0.02, 0.0, 0.0]
+        mean = sum(rel) / 3
+        sd = math.sqrt(sum((x - mean) ** 2 for x in rel) / 3)
+        self.assertAlmostEqual(c[u"juilland_d"], 1.0 - sd / mean / math.sqrt(2))
+
+    def test_python(self):
+        self.check(_stats_python(self.matrix()))
+
+    def test_numpy(self):
+        if numpy is None:
+            self.skipTest(u'numpy not available')
+        self.check(_stats_numpy(self.matrix()))
+
+    def test_empty(self):
+        for f in [_stats_python] + ([_stats_numpy] if numpy is not None else []):
+            m = FrequencyMatrix(2)
+            r = f(m)
+            self.assertEqual([x[u"tokens"] for x in r], [0, 0])
+            self.assertEqual([x[u"per_million"] for x in r], [None, None])
+            m = FrequencyMatrix(1)
+            m.add(10, [2])
+            r = f(m)
+            self.assertEqual((r[0][u"juilland_d"], r[0][u"dp"]), (None, 0.0))
+
+
+if __name__ == u'__main__':
+    unittest.main()
@@ -1,28 +1,20 @@
 u"""Miscellaneous utility functions."""
 
 import unittest
-import glob
+import array
 import os
 import re
 import sys
 
 
-def exception_exit(msg):
-    t, v, tb = sys.exc_info()
+def exception_exit(msg, exc_info=None):
+    if exc_info is None:
+        exc_info = sys.exc_info()
+    t, v, tb = exc_info
     print >>sys.stderr, u'{}.{}: {}'.format(t.__module__, t.__name__, v)
     sys.exit(msg)
 
 
-def listglob(globs):
-    l = []
-    for x in globs:
-        g = glob.glob(x)
-        if len(g) == 0:
-            sys.exit(u'pattern does not match any file: {}'.format(x))
-        l += g
-    return l
-
-
 def try_makedirs(path):
     if not os.path.exists(path):
         try:
@@ -82,22 +74,86 @@ def try_capture_join(r, w, sep=u' '):
     return sep.join(x)
 
 
+class Lexicon(object):
+    """Interning strings as small integers."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def get(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.ids[s] = i
+            self.strings.append(s)
+        return i
+
+    def string(self, i):
+        return self.strings[i]
+
+
 class Counter(object):
+    """Counting tokens and types of interned strings.
+
+    The ids are kept sorted and without duplicates, apart from those
+    added since the array was last compacted.
+    """
+
     def __init__(self):
-        self.distinct = set()
+        self.ids = array.array('i')
+        self.limit = 64
         self.total = 0
 
     def add(self, v):
         self.total += 1
-        self.distinct.add(v)
+        self.ids.append(v)
+        if len(self.ids) >= self.limit:
+            self._compact()
+
+    def _compact(self):
+        self.ids = array.array('i', sorted(set(self.ids)))
+        self.limit = 2 * len(self.ids) + 64
+
+    def distinct(self):
+        self._compact()
+        return self.ids
 
     def types(self):
-        return len(self.distinct)
+        return len(self.distinct())
 
 
 #### Unit tests
 
 
+class TestLexicon(unittest.TestCase):
+    def test_get(self):
+        lex = Lexicon()
+        self.assertEqual(lex.get(u'abc'), 0)
+        self.assertEqual(lex.get(u'def'), 1)
+        self.assertEqual(lex.get(u'abc'), 0)
+        self.assertEqual(lex.string(1), u'def')
+        self.assertEqual(len(lex.strings), 2)
+
+
+class TestCounter(unittest.TestCase):
+    def test_counts(self):
+        c = Counter()
+        self.assertEqual((c.total, c.types()), (0, 0))
+        for v in [3, 1, 3, 3, 0]:
+            c.add(v)
+        self.assertEqual((c.total, c.types()), (5, 3))
+        self.assertEqual(list(c.distinct()), [0, 1, 3])
+
+    def test_compact(self):
+        c = Counter()
+        for i in xrange(10000):
+            c.add(i % 7)
+        # Only the distinct ids and a bounded number of new ones are kept.
+        self.assertTrue(len(c.ids) < 100)
+        self.assertEqual((c.total, c.types()), (10000, 7))
+
+
 class TestCapture(unittest.TestCase):
     def test_none(self):
         self.assertEqual(try_capture(None, u' abc'), None)
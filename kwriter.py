@@ -0,0 +1,96 @@
+u"""Writing output files in background threads."""
+
+import Queue
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from io import open
+
+
+class WriteBehind(object):
+    """A bounded queue of files to write; write blocks when it is full.
+
+    The first error is kept in self.error as (name, exc_info), and no
+    further files are written after that. With zero threads, files are
+    written immediately by the calling thread.
+    """
+
+    def __init__(self, threads, queue_size):
+        self.queue = Queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.error = None
+        self.threads = [threading.Thread(target=self._run) for i in xrange(threads)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def _write(self, path, data, name):
+        if self.error is not None:
+            return
+        try:
+            with open(path, u'wb') as f:
+                f.write(data)
+        except:
+            with self.lock:
+                if self.error is None:
+                    self.error = (name, sys.exc_info())
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self._write(*item)
+
+    def write(self, path, data, name):
+        if len(self.threads) == 0:
+            self._write(path, data, name)
+        else:
+            self.queue.put((path, data, name))
+
+    def close(self):
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+
+#### Unit tests
+
+
+class TestWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write(self):
+        for threads in 0, 1, 3:
+            w = WriteBehind(threads, 1)
+            for i in xrange(20):
+                path = os.path.join(self.dir, u'{}.txt'.format(i))
+                w.write(path, b'x' * i, u'{}.txt'.format(i))
+            w.close()
+            self.assertEqual(w.error, None)
+            for i in xrange(20):
+                with open(os.path.join(self.dir, u'{}.txt'.format(i)), u'rb') as f:
+                    self.assertEqual(f.read(), b'x' * i)
+
+    def test_error(self):
+        for threads in 0, 2:
+            w = WriteBehind(threads, 2)
+            w.write(os.path.join(self.dir, u'a.txt'), b'a', u'a.txt')
+            w.write(os.path.join(self.dir, u'x', u'b.txt'), b'b', u'b.txt')
+            w.close()
+            name, exc_info = w.error
+            self.assertEqual(name, u'b.txt')
+            self.assertTrue(issubclass(exc_info[0], IOError))
+
+
+if __name__ == u'__main__':
+    unittest.main()
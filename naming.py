@@ -19,22 +19,30 @@ class UniqueNames(object):
         self.numbering = numbering
         self.keymap = {}
         self.used = set()
+        # Next suffix to try for each normalised name; all smaller
+        # suffixes are already known to be in use.
+        self.next = {}
 
     def get(self, key):
         if key in self.keymap:
             return self.keymap[key]
         norm = self.normalising(key)
-        i = None
-        while True:
-            if i is None:
-                val = norm
-            else:
+        if norm not in self.used:
+            val = norm
+        else:
+            i = self.next.get(norm, 1)
+            while True:
                 val = self.numbering(norm, i)
-            if val not in self.used:
-                self.used.add(val)
-                self.keymap[key] = val
-                return val
-            i = 1 if i is None else i + 1
+                i += 1
+                if val not in self.used:
+                    break
+            self.next[norm] = i
+        self.used.add(val)
+        self.keymap[key] = val
+        return val
+
+    def get_all(self, keys):
+        return [self.get(key) for key in keys]
 
 
 def printable_naming():
@@ -91,6 +99,22 @@ class TestUniqueNames(unittest.TestCase):
             self.assertEqual(u.get(None), u'--3')
             self.assertEqual(u.get(()), u'--4')
 
+    def test_many(self):
+        u = safe_naming()
+        self.assertEqual(u.get(u'x-3'), u'x-3')
+        self.assertEqual(u.get_all([u'x', u'X', u'x!', u'x?', u'x.']), [
+            u'x', u'x-1', u'x-2', u'x-4', u'x-5'
+        ])
+        self.assertEqual(u.get(u'x-6'), u'x-6')
+        self.assertEqual(u.get(u'x\n'), u'x-7')
+        self.assertEqual(u.get(u'x-7'), u'x-7-1')
+
+    def test_get_all(self):
+        u1 = printable_naming()
+        u2 = printable_naming()
+        keys = [u'', None, (), u'\b', u'a', u'a\n', u'', u'a\b'] * 100
+        self.assertEqual(u1.get_all(keys), [u2.get(key) for key in keys])
+
 
 if __name__ == u'__main__':
     unittest.main()
@@ -46,13 +46,44 @@ def _try_pathabbr(paths, n):
     return result
 
 
+def _pathunits(x):
+    # Path components in reverse order; a trailing separator
+    # sticks to the last component, as in pathtail.
+    l = pathsplit(x)
+    if len(l) > 1 and l[-1] == u'':
+        units = [l[-2:]] + [(y,) for y in reversed(l[:-2])]
+    else:
+        units = [(y,) for y in reversed(l)]
+    return tuple(units)
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _jointail(units, n):
+    l = []
+    for u in reversed(units[:n]):
+        l.extend(u)
+    return os.path.join(*l)
+
+
 def pathabbr(paths):
+    split = {}
+    for x in paths:
+        if x not in split:
+            split[x] = _pathunits(x)
+    # Two distinct paths need one more component than their longest
+    # common suffix; it suffices to compare neighbours in sorted order.
+    distinct = sorted(set(split.values()))
     n = 1
-    while True:
-        result = _try_pathabbr(paths, n)
-        if result is not None:
-            return result
-        n += 1
+    for a, b in zip(distinct, distinct[1:]):
+        n = max(n, _common_prefix(a, b) + 1)
+    return dict((x, _jointail(units, n)) for x, units in split.items())
 
 
 #### Unit tests
@@ -237,6 +268,34 @@ class TestPathAbbr(unittest.TestCase):
             u'b1////b2': u'b2',
         })
 
+    def test_trail(self):
+        self.assertEqual(pathabbr([u'a1/a2/', u'b1/a2/', u'a2']), {
+            u'a1/a2/': u'a1/a2/',
+            u'b1/a2/': u'b1/a2/',
+            u'a2': u'a2',
+        })
+        self.assertEqual(pathabbr([u'/a1', u'a1', u'b1']), {
+            u'/a1': u'/a1',
+            u'a1': u'a1',
+            u'b1': u'b1',
+        })
+
+    def test_iterative(self):
+        # Same result as trying n = 1, 2, 3, ... one at a time
+        names = [u'', u'/', u'a', u'b', u'a/', u'a//']
+        paths = []
+        for x in names:
+            for y in names:
+                for z in names:
+                    paths.append(x + u'/' + y + z)
+                    paths.append(x + y + u'/' + z)
+        for i in xrange(len(paths)):
+            l = paths[i:i+10]
+            n = 1
+            while _try_pathabbr(l, n) is None:
+                n += 1
+            self.assertEqual(pathabbr(l), _try_pathabbr(l, n))
+
 
 if __name__ == u'__main__':
     unittest.main()
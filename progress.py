@@ -0,0 +1,169 @@
+u"""Reporting progress, throughput, and estimated time remaining."""
+
+import sys
+import threading
+import time
+import unittest
+from io import StringIO
+
+
+MB = 1000000.0
+
+
+def format_time(s):
+    s = int(round(s))
+    return u'{}:{:02d}:{:02d}'.format(s // 3600, s // 60 % 60, s % 60)
+
+
+def format_eta(todo, done, elapsed):
+    if done <= 0 or elapsed <= 0:
+        return u'?'
+    return format_time(todo * elapsed / done)
+
+
+def _isatty(f):
+    try:
+        return f.isatty()
+    except AttributeError:
+        return False
+
+
+class Progress(object):
+    def __init__(self, total, out=None, interval=None, clock=time.time):
+        self.out = sys.stdout if out is None else out
+        self.tty = _isatty(self.out)
+        if interval is None:
+            interval = 1.0 if self.tty else 30.0
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.total = total
+        self.total_done = 0
+        self.started = clock()
+        self.name = None
+        self.width = 0
+
+    def start(self, name, size):
+        with self.lock:
+            self.name = name
+            self.size = size
+            self.done = 0
+            self.tokens = 0
+            self.matches = 0
+            self.warnings = 0
+            self.source_started = self.clock()
+            self.last = self.source_started
+            self._report(self.last)
+
+    def add(self, bytes=0, tokens=0, matches=0):
+        with self.lock:
+            self.done += bytes
+            self.total_done += bytes
+            self.tokens += tokens
+            self.matches += matches
+            now = self.clock()
+            if now - self.last >= self.interval:
+                self.last = now
+                self._report(now)
+
+    def warn(self):
+        with self.lock:
+            self.warnings += 1
+
+    def finish(self):
+        with self.lock:
+            self._report(self.clock(), final=True)
+            self.name = None
+
+    def status(self, now, final=False):
+        elapsed = now - self.source_started
+        pct = 100.0 * self.done / self.size if self.size > 0 else 100.0
+        s = u'{}: {:.0f}% of {:.1f} MB'.format(self.name, pct, self.size / MB)
+        if elapsed > 0:
+            s += u', {:.1f} MB/s, {:.0f} tokens/s, {:.0f} matches/s'.format(
+                self.done / MB / elapsed, self.tokens / elapsed, self.matches / elapsed
+            )
+        if self.warnings > 0:
+            s += u', {} warnings'.format(self.warnings)
+        if final:
+            s += u', time {}'.format(format_time(elapsed))
+        else:
+            s += u', ETA {}, total {}'.format(
+                format_eta(self.size - self.done, self.done, elapsed),
+                format_eta(self.total - self.total_done, self.total_done, now - self.started),
+            )
+        return s
+
+    def _report(self, now, final=False):
+        s = self.status(now, final)
+        if self.tty:
+            pad = max(0, self.width - len(s))
+            self.width = len(s)
+            self.out.write(u'\r' + s + u' ' * pad)
+            if final:
+                self.out.write(u'\n')
+                self.width = 0
+        else:
+            self.out.write(s + u'\n')
+        self.out.flush()
+
+
+#### Unit tests
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgress(unittest.TestCase):
+    def test_format_time(self):
+        self.assertEqual(format_time(0), u'0:00:00')
+        self.assertEqual(format_time(59.6), u'0:01:00')
+        self.assertEqual(format_time(3 * 3600 + 25 * 60 + 7), u'3:25:07')
+        self.assertEqual(format_eta(100, 0, 10), u'?')
+        self.assertEqual(format_eta(300, 100, 10), u'0:00:30')
+
+    def test_throttle(self):
+        out = StringIO()
+        clock = FakeClock()
+        p = Progress(4 * MB, out, 1.0, clock)
+        p.start(u'a', 2 * MB)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+        for i in xrange(4):
+            clock.now += 0.25
+            p.add(bytes=MB / 4, tokens=25000, matches=250)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1],
+            u'a: 50% of 2.0 MB, 1.0 MB/s, 100000 tokens/s, 1000 matches/s, ETA 0:00:01, total 0:00:03')
+        p.warn()
+        clock.now += 1.0
+        p.finish()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[2],
+            u'a: 50% of 2.0 MB, 0.5 MB/s, 50000 tokens/s, 500 matches/s, 1 warnings, time 0:00:02')
+
+    def test_threads(self):
+        out = StringIO()
+        p = Progress(1000, out, 1000.0)
+        p.start(u'a', 1000)
+
+        def work():
+            for i in xrange(100):
+                p.add(bytes=1, tokens=2, matches=3)
+
+        threads = [threading.Thread(target=work) for i in xrange(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual((p.done, p.tokens, p.matches, p.total_done), (1000, 2000, 3000, 1000))
+
+
+if __name__ == u'__main__':
+    unittest.main()